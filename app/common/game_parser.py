@@ -1,6 +1,207 @@
 import pgn
 import json
-from app import db, models
+import re
+from collections import deque
+from itertools import islice
+from types import SimpleNamespace
+from sqlalchemy.orm import subqueryload
+from app import app, db, models
+
+# Number of parsed games added to the db per commit
+BATCH_SIZE = 10000
+# Number of games loaded from the db per query by iter_games
+WINDOW_SIZE = 1000
+# Every game in a pgn starts with an Event tag after a blank line
+GAME_SEPARATOR = '\n\n[Event '
+
+# pgn looks its patterns up in the re module cache on every call, once per move
+# when parsing moves, and takes its lines off the front of a list. These are
+# the same patterns compiled once at import, the functions below replace pgn's
+# with the exact same logic, reading the lines from a deque.
+_LINE_BREAK_RE = re.compile(r'\s*(\\r)?\\n\s*')
+_LINE_COMMENT_RE = re.compile(r'(\s*;.*|^\s*)')
+_TAG_RE = re.compile(r'\[(\w*)\s*(.+)')
+_MOVE_NUMBER_RE = re.compile(r'^\s*(\d+\.+\s*)?')
+
+def _pre_process_text(text):
+    """Removes end line comments, blank lines and additional spaces.
+    Returns the remaining lines as a deque."""
+
+    text = _LINE_BREAK_RE.sub('\n', text.strip())
+    lines = deque()
+    for line in text.split('\n'):
+        line = _LINE_COMMENT_RE.sub('', line)
+        if line:
+            lines.append(line)
+
+    return lines
+
+def _next_token(lines):
+    """Takes the next tag or moves token off the lines from _pre_process_text"""
+
+    if not lines:
+        return None
+
+    token = lines.popleft().strip()
+    if token.startswith('['):
+        return token
+
+    while lines and not lines[0].startswith('['):
+        token += ' '+lines.popleft().strip()
+
+    return token.strip()
+
+def _parse_tag(token):
+    """Parses a tag token and returns a tuple like (tag_name, tag_value)"""
+
+    tag, value = _TAG_RE.match(token).groups()
+    return tag.lower(), value.strip('"[] ')
+
+def _parse_moves(token):
+    """Parses a moves token and returns a list of moves"""
+
+    moves = []
+    while token:
+        token = _MOVE_NUMBER_RE.sub('', token)
+
+        if token.startswith('{'):
+            pos = token.find('}')+1
+        else:
+            pos1 = token.find(' ')
+            pos2 = token.find('{')
+            if pos1 <= 0:
+                pos = pos2
+            elif pos2 <= 0:
+                pos = pos1
+            else:
+                pos = min(pos1, pos2)
+
+        if pos > 0:
+            moves.append(token[:pos])
+            token = token[pos:]
+        else:
+            moves.append(token)
+            token = ''
+
+    return moves
+
+pgn._pre_process_text = _pre_process_text
+pgn._next_token = _next_token
+pgn._parse_tag = _parse_tag
+pgn._parse_moves = _parse_moves
+
+# Characters that end a run of movetext in _fast_parse
+_DELIMITERS = '[{;'
+
+def _fast_parse(text):
+    """Parses a pgn string into a list of pgn.PGNGame in a single pass.
+    Gives the same games as pgn.loads for well formed pgns, without regexes:
+    the scanner jumps from one delimiter ('[', '{' or ';') to the next with
+    str.find, and splits the movetext in between on whitespace.
+    Unlike pgn.loads, brackets and semicolons inside comments are kept."""
+
+    if '\\n' in text:
+        text = _LINE_BREAK_RE.sub('\n', text)
+
+    games = []
+    game = None
+    pos = 0
+    end = len(text)
+    # Next position of each delimiter, only searched again once passed
+    next_pos = {char: -1 for char in _DELIMITERS}
+
+    while pos < end:
+        for char in _DELIMITERS:
+            if next_pos[char] != end and next_pos[char] < pos:
+                found = text.find(char, pos)
+                next_pos[char] = end if found == -1 else found
+        delimiter = min(next_pos.values())
+
+        # Movetext: move numbers are dropped, everything else is a move
+        for token in text[pos:delimiter].split():
+            token = _strip_move_number(token)
+            if token:
+                if game is None:
+                    game = pgn.PGNGame()
+                    games.append(game)
+                game.moves.append(token)
+
+        if delimiter == end:
+            break
+        char = text[delimiter]
+
+        if char == '[':
+            # Tag: [Name "Value"]
+            tag_end = text.find(']', delimiter)
+            if tag_end == -1:
+                tag_end = end
+            quote = text.find('"', delimiter, tag_end)
+            if quote == -1:
+                # Unquoted value: [Name Value]
+                tag, value = (text[delimiter+1:tag_end].split(None, 1) + ['', ''])[:2]
+            else:
+                tag = text[delimiter+1:quote]
+                close_quote = text.find('"', quote+1)
+                while close_quote != -1 and text[close_quote-1] == '\\':
+                    close_quote = text.find('"', close_quote+1)
+                if close_quote == -1:
+                    close_quote = end
+                value = text[quote+1:close_quote]
+                tag_end = text.find(']', close_quote)
+                if tag_end == -1:
+                    tag_end = end
+            if not game or game.moves:
+                game = pgn.PGNGame()
+                games.append(game)
+            tag = tag.strip().lower()
+            # A tag can't replace the moves parsed from the movetext
+            if tag != 'moves':
+                setattr(game, tag, value.strip('"[] '))
+            pos = tag_end + 1
+
+        elif char == '{':
+            # Comment: kept as a single move, line breaks become spaces
+            comment_end = text.find('}', delimiter)
+            comment_end = end if comment_end == -1 else comment_end + 1
+            comment = ' '.join(line.strip() for line in
+                                text[delimiter:comment_end].split('\n') if line.strip())
+            if game is None:
+                game = pgn.PGNGame()
+                games.append(game)
+            game.moves.append(comment)
+            pos = comment_end
+
+        else:
+            # End line comment: skipped
+            line_end = text.find('\n', delimiter)
+            pos = end if line_end == -1 else line_end + 1
+
+    return games
+
+def _strip_move_number(token):
+    """Removes a leading move number like '12.' or '12...' from a movetext token"""
+
+    digits = 0
+    while digits < len(token) and token[digits].isdigit():
+        digits += 1
+    if digits and token[digits:digits+1] == '.':
+        return token[digits:].lstrip('.')
+    return token
+
+def _iter_pgn_blocks(pgn_text):
+    """Yields the pgn text one game at a time, splitting it before each Event tag"""
+
+    # Windows line endings would hide the blank line between games
+    if '\r\n' in pgn_text:
+        pgn_text = pgn_text.replace('\r\n', '\n')
+    start = 0
+    end = pgn_text.find(GAME_SEPARATOR)
+    while end != -1:
+        yield pgn_text[start:end]
+        # Skip the blank line, the Event tag starts the next game
+        start = end + 2
+        end = pgn_text.find(GAME_SEPARATOR, start)
+    yield pgn_text[start:]
 
 class GameParser:
     """Init with a pgn to parse into an object that is db ready.
@@ -13,13 +214,18 @@ class GameParser:
 
         self.pgn = pgn_string
         self.game_id = game_id
-        self.parsed_games = pgn.loads(self.pgn) if self.pgn else None
         self.verbose = verbose
+        self.__parsed_games = None
 
-        if not self.parsed_games:
-            self.__print("Parsed games, 0 in total.")
-        else:
-            self.__print("Parsed games, {} in total".format(len(self.parsed_games)))
+    @property
+    def parsed_games(self):
+        """List of all games in the pgn, parsed on first access.
+        add_games doesn't need it, it parses the pgn one game at a time."""
+
+        if self.__parsed_games is None and self.pgn:
+            self.__parsed_games = self.__loader()(self.pgn)
+            self.__print("Parsed games, {} in total".format(len(self.__parsed_games)))
+        return self.__parsed_games
 
     def unparse_game(self, return_type='pgn'):
         """If GameParser initialized with game_id rather than string,
@@ -33,117 +239,204 @@ class GameParser:
         return self.format_game(game, return_type=return_type)
 
     def format_game(self, game, return_type='pgn'):
-        """Formats a game model into a pgn or dictionary"""
+        """Formats a game model into a pgn or dictionary.
+        The game itself is left untouched."""
 
-        players = self.__unparse_players_with_color(players=game.players, 
-                                                    game_id=game.id)
-        # Preparing the game object for a pgn dumps
-        game.white = players['white'].full_name()
-        game.black = players['black'].full_name()
+        players = self.__unparse_players_with_color(game)
+        white = players['white'].full_name()
+        black = players['black'].full_name()
 
         if return_type in ('dict', 'json'):
-            game_dict = {}
-            game_dict['event'] = game.event
-            game_dict['site'] = game.site
-            game_dict['date'] = game.date
-            game_dict['round'] = game.match_round
-            game_dict['white_elo'] = game.white_elo
-            game_dict['black_elo'] = game.black_elo
-            game_dict['white'] = game.white
-            game_dict['black'] = game.black
-            game_dict['moves'] = game.moves
-            game_dict['eco'] = game.eco
-            return_obj = game_dict
-            db.session.expunge_all()
-            return return_obj
+            return {
+                'event': game.event,
+                'site': game.site,
+                'date': game.date,
+                'round': game.match_round,
+                'white_elo': game.white_elo,
+                'black_elo': game.black_elo,
+                'white': white,
+                'black': black,
+                'moves': game.moves_text(),
+                'eco': game.eco,
+            }
         else:
-            game.moves = game.moves.split(',')
-            game.round = game.match_round
-            game.whiteelo = game.white_elo
-            game.blackelo = game.black_elo
-            # Fields not in our db but required by pgn (parser)
-            game.annotator = ''
-            game.plycount = ''
-            game.timecontrol = ''
-            game.time = ''
-            game.termination = ''
-            game.mode = ''
-            game.fen = ''
-            pgn_game = pgn.dumps(game)
-            db.session.expunge_all()
-            return pgn_game
+            # Preparing a copy of the game for a pgn dumps
+            pgn_game = SimpleNamespace(
+                    event=game.event,
+                    site=game.site,
+                    date=game.date,
+                    round=game.match_round,
+                    white=white,
+                    black=black,
+                    result=game.result,
+                    whiteelo=game.white_elo,
+                    blackelo=game.black_elo,
+                    moves=game.moves_list(),
+                    # Fields not in our db but required by pgn (parser)
+                    annotator='',
+                    plycount='',
+                    timecontrol='',
+                    time='',
+                    termination='',
+                    mode='',
+                    fen=''
+                )
+            return pgn.dumps(pgn_game)
 
     def format_games(self, games, return_type='pgn'):
         """Returns a list of games formatted either in a dictionary or pgn"""
-        return [self.format_game(game, return_type=return_type) for game in games]
+        return list(self.iter_format_games(games, return_type=return_type))
 
-    def add_games(self):
-        """If pgn was provided and parsed, adds games from pgn to the db"""
+    def iter_format_games(self, games, return_type='pgn'):
+        """Yields games formatted either in a dictionary or pgn, one at a time"""
+        for game in games:
+            yield self.format_game(game, return_type=return_type)
 
-        if self.parsed_games:
-            for game in self.parsed_games:
-
-                self.__print("Adding game {} vs {} {}".format(game.white, game.black, game.date))
-
-                # Returns dict like: {white: <id>, black: <id>}
-                db_player_ids = self.__add_players(white=game.white, 
-                                                    black=game.black)
-                db_game_id = self.__add_game(game)
-                self.__add_pairings(game_id=db_game_id,
-                                    player_ids=db_player_ids)
-                db.session.expunge_all()
-
-    def get_games(self, request_args={}):
-        """Return all games from DB as models"""
-        games = models.Game.query.all()
-        if any(request_args):
-            games = list(filter(lambda g: self.__game_match(g, request_args), games))
-        
-        return games
+    def add_games(self):
+        """If pgn was provided, parses it and adds its games to the db.
+        Games are parsed one at a time and flushed in batches of BATCH_SIZE,
+        so only one batch is held in memory.
+        All games are committed at once, none are added if any of them fails."""
+
+        if self.pgn:
+            # Maps (last_name, first_name) to the id of every player in the db
+            player_ids = {(p.last_name, p.first_name): p.id for p in
+                            models.Player.query.with_entities(models.Player.id,
+                                                            models.Player.first_name,
+                                                            models.Player.last_name)}
+            parsed_games = self.__iter_parsed_games()
+            games_count = 0
+            try:
+                batch = list(islice(parsed_games, BATCH_SIZE))
+                while batch:
+                    self.__add_batch(batch, player_ids)
+                    games_count += len(batch)
+                    batch = list(islice(parsed_games, BATCH_SIZE))
+                db.session.commit()
+            except:
+                db.session.rollback()
+                raise
+            self.__print("Added games, {} in total".format(games_count))
+
+    def get_games(self, request_args=None):
+        """Return all games from DB as models.
+        Filtered in the db by request_args if provided (name/eco only)"""
+        return list(self.iter_games(request_args=request_args))
+
+    def iter_games(self, request_args=None):
+        """Yields games from DB as models, ordered by id and loaded WINDOW_SIZE at a time.
+        Filtered in the db by request_args if provided (name/eco only)"""
+        query = models.Game.query.options(subqueryload(models.Game.pairings))
+        if request_args:
+            query = self.__filter_games(query,
+                                        name=request_args.get('name', '').lower(),
+                                        eco=request_args.get('eco', '').lower())
+
+        # Each window starts after the last game id of the previous one
+        last_id = 0
+        while True:
+            games = (query.filter(models.Game.id > last_id)
+                            .order_by(models.Game.id)
+                            .limit(WINDOW_SIZE)
+                            .all())
+            yield from games
+            if len(games) < WINDOW_SIZE:
+                return
+            last_id = games[-1].id
 
     def get_game(self, id=1):
         """TODO(Returns a single game from DB as a model)"""
         return models.Game.query.get(id)
 
-    def player_in_db(self, player, stringified=False):
-        """Takes a player name and checks if player in db
+    def player_in_db(self, player, cache=None):
+        """Takes a player name dict like {'first_name': <string>, 'last_name': <string>}
+        and checks if player in db
         If present, it returns the player id, else returns None.
-        If player is stringified, it parses the name into a dict.
+        If a cache dict of {(last_name, first_name): <id>} is provided,
+        it is used instead of querying the db.
         """
 
-        if stringified:
-            player = self.__parse_player_name(player)
+        if cache is not None:
+            return cache.get((player['last_name'], player['first_name']))
+
         player_in_db = models.Player.query.filter_by(
                         first_name=player['first_name'],
-                        last_name=player['last_name'])
+                        last_name=player['last_name']).first()
 
-        if player_in_db.count() > 0:
-            return player_in_db.first().id
-        else:
-            return None
+        return player_in_db.id if player_in_db else None
+
+    def player_in_db_by_string(self, name_string, cache=None):
+        """Same as player_in_db, for a player name string like 'LastName, FirstName'"""
+        return self.player_in_db(self.__parse_player_name(name_string), cache=cache)
+
+    def __unparse_players_with_color(self, game):
+        """Takes a db Game object.
+        Returns players with colors in the game, like {'white': <Player>, 'black': <Player>}"""
 
-    def __unparse_players_with_color(self, players, game_id):
-        """Takes an array of db Player objects and the game_id.
-        Returns players with colors in the game"""
+        players = {player.id: player for player in game.players}
+        return {pairing.color: players[pairing.player_id] for pairing in game.pairings}
 
-        players_obj = {}
-        pairing_1 = models.Pairing.query.filter_by(player_id=players[0].id,
-                                            game_id=game_id).first()
-        pairing_2 = models.Pairing.query.filter_by(player_id=players[1].id,
-                                            game_id=game_id).first()
-        if pairing_1.color == 'white':
-            players_obj['white'] = players[0]
-            players_obj['black'] = players[1]
-        elif pairing_2.color == 'white':
-            players_obj['white'] = players[1]
-            players_obj['black'] = players[0]
+    def __iter_parsed_games(self):
+        """Yields the games in the pgn, parsing one game at a time
+        unless the whole pgn was already parsed"""
 
-        return players_obj
+        if self.__parsed_games is not None:
+            yield from self.__parsed_games
+        else:
+            loads = self.__loader()
+            for block in _iter_pgn_blocks(self.pgn):
+                yield from loads(block)
+
+    def __loader(self):
+        """Returns the function parsing a pgn string into a list of games,
+        _fast_parse if PGN_FAST_PARSER is set in the config, else pgn.loads"""
+
+        return _fast_parse if app.config['PGN_FAST_PARSER'] else pgn.loads
+
+    def __add_batch(self, games, player_ids):
+        """Adds a list of parsed games along with their players and pairings.
+        Players are flushed first so their ids are known before the pairings
+        are built, then the games and pairings are flushed. Nothing is committed.
+        New player ids are added to player_ids for the following batches."""
+
+        players_buf = {}
+        parsed_names = {}
+        games_buf = []
+        pending = []
+
+        for game in games:
+
+            self.__print("Adding game {} vs {} {}".format(game.white, game.black, game.date))
+
+            # Returns dict like: {white: <key>, black: <key>}
+            player_keys = self.__add_players(white=game.white,
+                                            black=game.black,
+                                            player_ids=player_ids,
+                                            players_buf=players_buf,
+                                            parsed_names=parsed_names)
+            db_game = self.__add_game(game)
+            games_buf.append(db_game)
+            pending.append((db_game, player_keys))
+
+        db.session.add_all(players_buf.values())
+        db.session.flush()
+        for key, db_player in players_buf.items():
+            player_ids[key] = db_player.id
+
+        db.session.add_all(games_buf)
+        db.session.flush()
+
+        pairings_buf = []
+        for db_game, player_keys in pending:
+            pairings_buf.extend(self.__add_pairings(
+                game_id=db_game.id,
+                player_ids={color: player_ids[key] for color, key in player_keys.items()}))
+        db.session.add_all(pairings_buf)
+        db.session.flush()
 
     def __add_game(self, game):
-        """Takes a single game object and adds it to the Game table in the db"""
+        """Takes a single game object and returns it as a Game model ready to be added to the db"""
 
-        moves_string = (',').join(game.moves)
         db_game = models.Game(
                 event=game.event,
                 site=game.site,
@@ -152,45 +445,32 @@ class GameParser:
                 result=game.result,
                 white_elo=game.whiteelo,
                 black_elo=game.blackelo,
-                moves=moves_string,
+                moves=models.Game.compress_moves(game.moves),
                 eco = game.eco
             )
-        db.session.add(db_game)
-        db.session.commit()
-        return db_game.id
-
-    def __add_players(self, white, black):
-        """Adds players to db if players not in db.
-        Returns dict like {'white': <id>, 'black': <id>}"""
-
-        white_parsed = self.__parse_player_name(white)
-        black_parsed = self.__parse_player_name(black)
-
-        white_id = self.player_in_db(white_parsed)
-        black_id = self.player_in_db(black_parsed)
-
-        if not white_id:
-            db_white = models.Player(
-                    first_name= white_parsed['first_name'],
-                    last_name = white_parsed['last_name']
-                    )
-            db.session.add(db_white)
-
-        if not black_id:
-            db_black = models.Player(
-                    first_name= black_parsed['first_name'],
-                    last_name = black_parsed['last_name']
-                    )
-            db.session.add(db_black)
-
-        db.session.commit()
-
-        if not white_id:
-            white_id = db_white.id
-        if not black_id:
-            black_id = db_black.id
-
-        return {'white': white_id, 'black': black_id}
+        return db_game
+
+    def __add_players(self, white, black, player_ids, players_buf, parsed_names):
+        """Looks up both players, buffering a new Player model for each one not in the db.
+        player_ids maps (last_name, first_name) to the id of players already in the db,
+        players_buf maps it to players waiting to be added.
+        parsed_names caches parsed names by name string, each name is parsed once.
+        Returns dict like {'white': <key>, 'black': <key>}"""
+
+        player_keys = {}
+        for color, name in (('white', white), ('black', black)):
+            parsed = parsed_names.get(name)
+            if parsed is None:
+                parsed = parsed_names[name] = self.__parse_player_name(name)
+            key = (parsed['last_name'], parsed['first_name'])
+            if key not in players_buf and not self.player_in_db(parsed, cache=player_ids):
+                players_buf[key] = models.Player(
+                        first_name= parsed['first_name'],
+                        last_name = parsed['last_name']
+                        )
+            player_keys[color] = key
+
+        return player_keys
 
 
     def __parse_player_name(self, name_string):
@@ -200,16 +480,14 @@ class GameParser:
         'LastName, FirstName M' or 'LastName, FirstName'
         first_name field includes middle name at the end.
         """
-        name_dict = {}
-        # Split by comma. First name may include middle name.
-        name_array = name_string.split(',')
-        name_dict['first_name'] = name_array[1].strip() if len(name_array) > 1 else ''
-        name_dict['last_name'] = name_array[0].strip()
-        return name_dict 
+        # Split at the first comma. First name may include middle name.
+        last_name, comma, first_name = name_string.partition(',')
+        return {'first_name': first_name.strip() if comma else '',
+                'last_name': last_name.strip()}
 
     def __add_pairings(self, game_id, player_ids):
         """Receives a game_id and a dict with player ids,
-        adds two pairings for white and black"""
+        returns two pairings for white and black"""
 
         black_pairing = models.Pairing(game_id=game_id,
                                         player_id=player_ids['black'],
@@ -217,26 +495,22 @@ class GameParser:
         white_pairing = models.Pairing(game_id=game_id, 
                                         player_id = player_ids['white'],
                                         color='white')
-        db.session.add(black_pairing)
-        db.session.add(white_pairing)
-        db.session.commit()
-
-    def __game_match(self, game, request_args):
-        """Match games based on filters defined in games.py"""
-        if 'name' in request_args:
-            players = self.__unparse_players_with_color(
-                players=game.players,
-                game_id=game.id)
-
-            if request_args['name'] not in players['white'].full_name().lower() and \
-                request_args['name'] not in players['black'].full_name().lower():
-                return False
-
-        if 'eco' in request_args:
-            if request_args['eco'].lower() != game.eco.lower():
-                return False
-
-        return True
+        return [black_pairing, white_pairing]
+
+    def __filter_games(self, query, name, eco):
+        """Adds the filters defined in games.py to a Game query.
+        name and eco are expected lowercased, empty strings don't filter.
+        The indexed eco comparison comes first, it is the cheapest."""
+        if eco:
+            query = query.filter(models.Game.eco_lower == eco)
+
+        if name:
+            # Wildcards in the name are matched literally
+            name = name.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            query = query.filter(models.Game.players.any(
+                models.Player.full_name_lower.contains(name, escape='\\')))
+
+        return query
 
     def __print(self, output):
         """Print output if verbose is set to True"""
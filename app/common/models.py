@@ -1,3 +1,5 @@
+import zlib
+from sqlalchemy.orm import validates
 from app import db
 
 class Pairing(db.Model):
@@ -31,13 +33,44 @@ class Game(db.Model):
     white_elo = db.Column(db.Integer)
     black_elo = db.Column(db.Integer)
     eco = db.Column(db.String(32))
-    # TODO(limit text size for moves, sqlite3 can't do this so it needs to be done manually)
-    moves = db.Column(db.Text())
+    # Lowercased eco, games are filtered by case insensitive eco
+    eco_lower = db.Column(db.String(32), index=True)
+    # Comma separated moves, zlib compressed. Use Game.compress_moves to set it.
+    moves = db.Column(db.LargeBinary())
     players = db.relationship('Player', secondary='pairings', backref='game', lazy='joined')
+    # Pairings are written through their own model, this is only used to read colors
+    pairings = db.relationship('Pairing', viewonly=True)
     # TODO(add a sensible unique constraint)
     def __repr__(self):
         return '<Game %r>' % (self.id)
 
+    @validates('eco')
+    def validate_eco(self, key, eco):
+        """Keeps eco_lower in sync with eco"""
+        self.eco_lower = eco.lower() if eco else eco
+        return eco
+
+    @validates('moves')
+    def validate_moves(self, key, moves):
+        """Drops the cached moves_list when moves change"""
+        self.__dict__.pop('_moves_list', None)
+        return moves
+
+    @staticmethod
+    def compress_moves(moves):
+        """Takes a list of moves and returns them as stored in the moves column"""
+        return zlib.compress(','.join(moves).encode('utf-8'), 1)
+
+    def moves_text(self):
+        """Returns the moves as a comma separated string"""
+        return zlib.decompress(self.moves).decode('utf-8')
+
+    def moves_list(self):
+        """Returns the moves as a list, the stored moves are only decompressed once per instance"""
+        if '_moves_list' not in self.__dict__:
+            self._moves_list = self.moves_text().split(',')
+        return self._moves_list
+
 class Player(db.Model):
     """This table stores player names and other player constants."""
 
@@ -47,10 +80,24 @@ class Player(db.Model):
     first_name = db.Column(db.String(64))
     middle_name = db.Column(db.String(64))
     last_name = db.Column(db.String(64))
+    # Lowercased full_name(), games are filtered by case insensitive player name
+    full_name_lower = db.Column(db.String(130))
     games = db.relationship('Game', secondary='pairings', backref='player')
 
     def __repr__(self):
         return '<Player %r, %r %r>' % (self.last_name, self.first_name, self.middle_name)
 
+    @validates('first_name', 'last_name')
+    def validate_name(self, key, value):
+        """Keeps full_name_lower in sync with the name columns.
+        Lowercased in python, sql lower() only folds ascii characters."""
+        self.__dict__.pop('_full_name', None)
+        names = {'first_name': self.first_name, 'last_name': self.last_name, key: value}
+        self.full_name_lower = '{}, {}'.format(names['last_name'], names['first_name']).lower()
+        return value
+
     def full_name(self):
-        return '{}, {}'.format(self.last_name, self.first_name)
+        """Returns the name like 'LastName, FirstName', only formatted once per instance"""
+        if '_full_name' not in self.__dict__:
+            self._full_name = '{}, {}'.format(self.last_name, self.first_name)
+        return self._full_name
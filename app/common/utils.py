@@ -1 +1,11 @@
-# common utils
\ No newline at end of file
+# common utils
+import json
+
+def iter_json_array(items):
+    """Yields the JSON array of items piece by piece, one item at a time.
+    Used to stream large lists without serializing them all at once."""
+
+    yield '['
+    for i, item in enumerate(items):
+        yield (', ' if i else '') + json.dumps(item)
+    yield ']\n'
@@ -1,8 +1,10 @@
+from flask import Response, stream_with_context
 from flask_restful import Resource, abort, reqparse, request
 import pgn, json
 
 # Import app modules:
 from app.common.game_parser import GameParser
+from app.common.utils import iter_json_array
 
 # Import games list
 from app import limiter
@@ -46,9 +48,12 @@ class GameList(Resource):
         args = parser.parse_args()
 
         game_parser = GameParser()
-        games = game_parser.get_games(args)
+        games = game_parser.iter_games(args)
+        formatted_games = game_parser.iter_format_games(games, return_type=args['format'])
 
-        return game_parser.format_games(games, return_type=args['format'])
+        # Games are serialized as they are formatted rather than all at once
+        return Response(stream_with_context(iter_json_array(formatted_games)),
+                        mimetype='application/json')
 
     def post(self):
         """Creates a new game via an API request"""
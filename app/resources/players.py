@@ -38,7 +38,7 @@ class PlayerList(Resource):
         args = parser.parse_args()
         players = models.Player.query.all()
         
-        if any(args):
+        if args:
             players = list(filter(lambda p: player_match(p, args), players))
 
         return marshal(players, player_fields)
@@ -6,6 +6,10 @@ SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(basedir, 'app.db')
 SQLALCHEMY_MIGRATE_REPO = os.path.join(basedir, 'db_repository')
 SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+# Game parser configs
+# Parse pgns with the single pass scanner in game_parser instead of pgn.loads
+PGN_FAST_PARSER = False
+
 # Flask Limiter configs
 RATELIMIT_STRATEGY = 'fixed-window'
 RATELIMIT_GLOBAL = '2/second,100/minute'
\ No newline at end of file
@@ -0,0 +1,46 @@
+#!flask/bin/python
+# Script to upgrade a database created by an older version of ChessPi.
+# Run it instead of db_migrate.py, sqlalchemy-migrate can't generate the migration
+# because the type of the moves column changed. Rows that are already converted are skipped.
+
+from sqlalchemy import inspect
+from app import db, models
+
+with db.engine.begin() as connection:
+    # Add the columns missing from the old schema. Moves keeps its TEXT type,
+    # sqlite stores the compressed blobs in it all the same
+    num_columns = 0
+    for table in db.metadata.sorted_tables:
+        existing = {column['name'] for column in inspect(connection).get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                connection.execute('ALTER TABLE {} ADD COLUMN {} {}'.format(
+                    table.name, column.name, column.type.compile(db.engine.dialect)))
+                num_columns += 1
+    print('Added {} columns'.format(num_columns))
+
+    # Moves used to be stored as a plain comma separated string
+    rows = connection.execute(db.text('SELECT id, moves FROM games')).fetchall()
+    num_games = 0
+    for game_id, moves in rows:
+        if isinstance(moves, str):
+            connection.execute(db.text('UPDATE games SET moves = :moves WHERE id = :id'),
+                                moves=models.Game.compress_moves(moves.split(',')),
+                                id=game_id)
+            num_games += 1
+    print('Compressed the moves of {} games'.format(num_games))
+
+    # Eco codes are ascii, sql lower() is enough for them
+    result = connection.execute(db.text('UPDATE games SET eco_lower = lower(eco)'))
+    print('Set the lowercased eco of {} games'.format(result.rowcount))
+    # db.create_all only creates the index of eco_lower on a new database
+    connection.execute(db.text('CREATE INDEX IF NOT EXISTS ix_games_eco_lower ON games (eco_lower)'))
+
+    # Lowercased in python like Player.validate_name, sql lower() only folds ascii
+    rows = connection.execute(db.text('SELECT id, first_name, last_name FROM players '
+                                        'WHERE full_name_lower IS NULL')).fetchall()
+    for player_id, first_name, last_name in rows:
+        connection.execute(db.text('UPDATE players SET full_name_lower = :name WHERE id = :id'),
+                            name='{}, {}'.format(last_name, first_name).lower(),
+                            id=player_id)
+    print('Set the lowercased full name of {} players'.format(len(rows)))
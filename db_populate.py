@@ -1,5 +1,6 @@
 # Script to import the sample games into the database.
 
+from itertools import islice
 from app.common.game_parser import GameParser
 from app import models, db
 from sample_data.games_string import SAMPLE_GAMES_STRING
@@ -22,7 +23,7 @@ gp.add_games()
 # TODO: Optimize the GameParser because it takes way too
 #       long to parse large numbers of games
 with open('sample_data/kasparov.pgn', 'r', encoding = "ISO-8859-1") as myfile:
-    games_data=''.join(myfile.readlines()[0:341])
+    games_data=''.join(islice(myfile, 341))
 
 gp = GameParser(pgn_string=games_data, verbose=True)
 gp.add_games()
@@ -11,7 +11,8 @@ from sample_data.games_string import SAMPLE_GAMES_STRING
 
 from app import app, db
 from app import models
-from app.common.game_parser import GameParser
+from app.common import game_parser
+from app.common.game_parser import GameParser, _iter_pgn_blocks, _fast_parse
 
 class GameParserTests(unittest.TestCase):
     def setUp(self):
@@ -52,6 +53,69 @@ class GameParserTests(unittest.TestCase):
         # print('\n===========================================================\n')
         assert players_added and games_added and pairings_added
 
+    def test_add_games_in_batches(self):
+        """Players shared by games in different batches should only be added once"""
+        batch_size = game_parser.BATCH_SIZE
+        game_parser.BATCH_SIZE = 1
+        try:
+            GameParser(pgn_string=SAMPLE_GAMES_STRING).add_games()
+        finally:
+            game_parser.BATCH_SIZE = batch_size
+
+        kasparov_count = models.Player.query.filter_by(first_name='Gary',
+                                                        last_name='Kasparov').count()
+        assert (len(models.Player.query.all()) == 4 and
+                kasparov_count == 1 and
+                len(models.Game.query.all()) == 3 and
+                len(models.Pairing.query.all()) == 6)
+
+    def test_add_games_in_batches_rollback(self):
+        """A game failing in a later batch should leave no games or players in the db"""
+        no_white_game = ('\n\n[Event "Broken"]\n[Black "Doe, John"]\n[Result "*"]\n'
+                         '[WhiteElo ""]\n[BlackElo ""]\n\n1. e4 *\n')
+        batch_size = game_parser.BATCH_SIZE
+        game_parser.BATCH_SIZE = 1
+        try:
+            with self.assertRaises(AttributeError):
+                GameParser(pgn_string=SAMPLE_GAMES_STRING.rstrip() + no_white_game).add_games()
+        finally:
+            game_parser.BATCH_SIZE = batch_size
+
+        assert (len(models.Game.query.all()) == 0 and
+                len(models.Player.query.all()) == 0)
+
+    def test_iter_pgn_blocks(self):
+        """Splits a pgn string into one block per game, each starting with its Event tag"""
+        blocks = list(_iter_pgn_blocks(SAMPLE_GAMES_STRING))
+        assert (len(blocks) == 3 and
+                all(block.startswith('[Event ') for block in blocks) and
+                [len(pgn.loads(block)) for block in blocks] == [1, 1, 1])
+        crlf_blocks = list(_iter_pgn_blocks(SAMPLE_GAMES_STRING.replace('\n', '\r\n')))
+        assert crlf_blocks == blocks
+
+    def test_fast_parse(self):
+        """The single pass scanner should parse the same games as pgn.loads,
+        and be used by add_games when PGN_FAST_PARSER is set"""
+        fast_games = _fast_parse(SAMPLE_GAMES_STRING)
+        pgn_games = pgn.loads(SAMPLE_GAMES_STRING)
+
+        app.config['PGN_FAST_PARSER'] = True
+        try:
+            GameParser(pgn_string=SAMPLE_GAMES_STRING).add_games()
+        finally:
+            app.config['PGN_FAST_PARSER'] = False
+
+        # A Moves tag must not replace the moves, unquoted tag values are read
+        moves_tag_game = _fast_parse('[Event "A"]\n[Moves "x"]\n\n1. e4 e5 1-0')[0]
+        unquoted_game = _fast_parse('[Event A]\n[Site "B"]\n\n1. e4 1-0')[0]
+
+        assert ([game.__dict__ for game in fast_games] ==
+                [game.__dict__ for game in pgn_games] and
+                len(models.Game.query.all()) == 3 and
+                moves_tag_game.moves == ['e4', 'e5', '1-0'] and
+                unquoted_game.event == 'A' and
+                unquoted_game.site == 'B')
+
     def test_player_in_db(self):
         """Tests whether a player is added to db properly without duplicates.
         And whether player_in_db can return its id or None for no matches"""
@@ -61,6 +125,7 @@ class GameParserTests(unittest.TestCase):
         false_player = {'first_name':'Gary', 'last_name':'Carlsen'}
         player_in_db = gp.player_in_db(test_player)
         false_player_in_db = gp.player_in_db(false_player)
+        player_in_db_by_string = gp.player_in_db_by_string('Kasparov, Gary')
         test_player_count = models.Player.query.filter_by(first_name='Gary',
                                                             last_name='Kasparov').count()
 
@@ -70,6 +135,7 @@ class GameParserTests(unittest.TestCase):
         # print('\n===========================================================\n')
         assert (player_in_db is not None and
                 isinstance(player_in_db, int) and
+                player_in_db_by_string == player_in_db and
                 test_player_count == 1 and
                 not false_player_in_db)
 
@@ -115,11 +181,13 @@ class GameParserTests(unittest.TestCase):
                     len(loaded_pgn) == 1 and
                     loaded_pgn[0].event == 'Wch U16' and
                     loaded_pgn[0].site == 'Wattignies')
+        # Formatting should not modify the game model
+        session_check = game_1 in db.session and not db.session.dirty
         # print('\n===========================================================')
         # print("\nMethod format_game should return games in specified format.")
         # print("\nIt should return a pgn string if format not specified")
         # print('\n===========================================================\n')
-        assert (dict_check and pgn_check)
+        assert (dict_check and pgn_check and session_check)
 
     def test_format_games(self):
         """Returns a list of formatted games in given return type"""
@@ -148,6 +216,38 @@ class GameParserTests(unittest.TestCase):
         assert (len(games) == 3 and len(games_with_arg) == 1 and
                 games_with_arg[0].eco == games[0].eco == 'B22')
 
+    def test_get_games_by_name(self):
+        """Filters games by a case insensitive substring of either player's full name.
+        Non ascii names are matched, wildcard characters are matched literally."""
+        gp = GameParser(pgn_string=SAMPLE_GAMES_STRING +
+                        '\n\n[Event "Test"]\n[White "Öztürk, Ali"]\n[Black "Kasparov, Gary"]\n'
+                        '[WhiteElo ""]\n[BlackElo ""]\n[ECO "A00"]\n\n1.e4 e5 1-0')
+        gp.add_games()
+        assert ([game.id for game in gp.get_games(request_args={'name': 'öztürk'})] == [4] and
+                len(gp.get_games(request_args={'name': 'kasparov, g'})) == 4 and
+                gp.get_games(request_args={'name': '_'}) == [] and
+                gp.get_games(request_args={'name': '%'}) == [] and
+                gp.get_games(request_args={'name': '\\'}) == [])
+
+    def test_iter_games(self):
+        """Yields the same Game models as get_games, loaded WINDOW_SIZE at a time"""
+        gp = GameParser(pgn_string=SAMPLE_GAMES_STRING + '\n\n' + SAMPLE_GAMES_STRING)
+        gp.add_games()
+        all_args = [None, {'name': 'kasparov'}, {'name': 'galle'}, {'eco': 'c11'}]
+        expected_ids = [[game.id for game in gp.get_games(request_args=args)]
+                        for args in all_args]
+
+        window_size = game_parser.WINDOW_SIZE
+        game_parser.WINDOW_SIZE = 2
+        try:
+            windowed_ids = [[game.id for game in gp.iter_games(request_args=args)]
+                            for args in all_args]
+        finally:
+            game_parser.WINDOW_SIZE = window_size
+
+        assert (windowed_ids == expected_ids and
+                expected_ids == [[1, 2, 3, 4, 5, 6], [1, 2, 3, 4, 5, 6], [2, 5], [2, 5]])
+
     def test_get_game(self):
         """Returns a single game from db based on id.
         Returns game 1 by default"""
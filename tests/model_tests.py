@@ -64,6 +64,17 @@ class ModelTests(unittest.TestCase):
     reread_game = models.Game.query.get(1)
     assert reread_game.site == 'Mars'
 
+  def test_game_eco_lower(self):
+    """Game.eco_lower should follow eco when a game is created or updated"""
+    game = self.__create_test_game()
+    created_eco_lower = models.Game.query.get(1).eco_lower
+    game.eco = 'C11'
+    db.session.commit()
+    assert (
+      created_eco_lower == sample_game.eco.lower() and
+      models.Game.query.get(1).eco_lower == 'c11'
+    )
+
   def test_delete_game(self):
     """Delete game entry from db with game id"""
     game = self.__create_test_game()
@@ -71,6 +82,18 @@ class ModelTests(unittest.TestCase):
     games_count = len(models.Game.query.all())
     assert games_count == 0
 
+  def test_game_moves_list(self):
+    """Test Game.moves_list method"""
+    game = self.__create_test_game()
+    game_from_db = models.Game.query.get(1)
+    assert (
+      game_from_db.moves_list() == sample_game.moves and
+      game_from_db.moves_list() is game_from_db.moves_list()
+    )
+    game_from_db.moves = models.Game.compress_moves(['d4'])
+    db.session.commit()
+    assert game_from_db.moves_list() == ['d4']
+
   def test_create_player(self):
     """Create a player entry in db"""
     player = self.__create_mock_player()
@@ -79,7 +102,18 @@ class ModelTests(unittest.TestCase):
   def test_player_full_name(self):
     """Test Player.full_name method"""
     player = self.__create_mock_player()
-    assert player.full_name() == 'Carlsen, Magnus'
+    assert (player.full_name() == 'Carlsen, Magnus' and
+            player.full_name() is player.full_name())
+
+  def test_player_full_name_after_rename(self):
+    """Player.full_name should follow the name columns when a player is renamed"""
+    player = self.__create_mock_player()
+    old_full_name = player.full_name()
+    player.first_name = 'Test'
+    db.session.commit()
+    assert (old_full_name == 'Carlsen, Magnus' and
+            player.full_name() == 'Carlsen, Test' and
+            player.full_name_lower == 'carlsen, test')
 
   def test_update_player(self):
     """Update fields of a player in db"""
@@ -131,7 +165,7 @@ class ModelTests(unittest.TestCase):
       white_elo=sample_game.whiteelo,
       black_elo=sample_game.blackelo,
       eco=sample_game.eco,
-      moves=(",").join(sample_game.moves),
+      moves=models.Game.compress_moves(sample_game.moves),
       )
     db.session.add(game)
     db.session.commit()